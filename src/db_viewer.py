@@ -1,26 +1,45 @@
+import re
 import sys
-import sqlite3
 import csv
+from array import array
+from bisect import bisect_left
 from datetime import datetime
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QComboBox, QTableView, QFileDialog,
                             QPushButton, QMessageBox, QTextEdit, QStatusBar,
                             QToolBar, QInputDialog, QSplitter, QListWidget,
-                            QDialog, QFormLayout, QLineEdit, QDialogButtonBox)
-from PyQt6.QtSql import QSqlDatabase, QSqlTableModel, QSqlQuery
-from PyQt6.QtCore import Qt
+                            QDialog, QFormLayout, QLineEdit, QDialogButtonBox,
+                            QHeaderView, QListWidgetItem)
+from PyQt6.QtSql import QSqlDatabase, QSqlQuery
+from PyQt6.QtCore import (Qt, QTimer, QObject, QRunnable, QThreadPool, pyqtSignal,
+                          QAbstractTableModel, QModelIndex)
 from PyQt6.QtGui import QAction, QUndoStack, QUndoCommand
 
+# Statements are classified by their first keyword, after any leading whitespace and comments.
+# Only introspection PRAGMAs count as reads; the rest configure the connection (also in the
+# PRAGMA x(value) form) and must run on the main one.
+_LEADING = r"(?:\s|--[^\n]*(?:\n|$)|/\*(?:[^*]|\*(?!/))*\*/)*"
+_READ_PRAGMAS = ("table_info|table_xinfo|table_list|index_list|index_info|index_xinfo|foreign_key_list|"
+                 "foreign_key_check|database_list|collation_list|function_list|module_list|pragma_list|"
+                 "compile_options|integrity_check|quick_check")
+_READ_RE = re.compile(_LEADING + r"(?:SELECT|WITH|VALUES|EXPLAIN|PRAGMA\s+(?:\w+\s*\.\s*)?(?:"
+                      + _READ_PRAGMAS + r"))\b", re.IGNORECASE)
+_DML_RE = re.compile(_LEADING + r"(?:UPDATE|INSERT|REPLACE|DELETE)\b", re.IGNORECASE)
+# Statements that change more cells than this aren't captured for undo
+_UNDO_LIMIT = 10000
+
+def _ident(name):
+    # Quote an identifier for interpolation into SQL, doubling any embedded quotes
+    return '"' + name.replace('"', '""') + '"'
+
 class AddRowDialog(QDialog):
-    def __init__(self, model, parent=None):
+    def __init__(self, headers, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Add New Row")
-        self.model = model
         self.layout = QFormLayout()
         
         self.inputs = []
-        for col in range(model.columnCount()):
-            header = model.headerData(col, Qt.Orientation.Horizontal)
+        for header in headers:
             input_field = QLineEdit()
             self.inputs.append((header, input_field))
             self.layout.addRow(header, input_field)
@@ -36,6 +55,252 @@ class AddRowDialog(QDialog):
     def get_values(self):
         return {header: input_field.text() for header, input_field in self.inputs}
 
+def open_worker_connection(connection_name, worker_name):
+    # Clone the app's connection for the calling thread, so every read goes through
+    # the same SQLite library (and the same POSIX locks) as the Qt connection
+    db = QSqlDatabase.cloneDatabase(connection_name, worker_name)
+    db.setConnectOptions("QSQLITE_OPEN_READONLY")
+    if not db.open():
+        raise RuntimeError(db.lastError().text())
+    return db
+
+class WorkerSignals(QObject):
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(int)
+    error = pyqtSignal(str)
+
+class CsvExportTask(QRunnable):
+    def __init__(self, connection_name, sql, file_name):
+        super().__init__()
+        self.connection_name = connection_name
+        self.sql = sql
+        self.file_name = file_name
+        self.signals = WorkerSignals()
+
+    def run(self):
+        worker_name = f"export_{id(self)}"
+        try:
+            rows = self._export(worker_name)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+            return
+        finally:
+            QSqlDatabase.removeDatabase(worker_name)
+        self.signals.finished.emit(rows)
+
+    def _export(self, worker_name):
+        rows = 0
+        db = open_worker_connection(self.connection_name, worker_name)
+        try:
+            query = QSqlQuery(db)
+            query.setForwardOnly(True)
+            if not query.exec(self.sql):
+                raise RuntimeError(query.lastError().text())
+            record = query.record()
+            count = record.count()
+            with open(self.file_name, 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow([record.fieldName(i) for i in range(count)])
+                # Rows are written in batches to keep progress signals infrequent
+                batch = []
+                while query.next():
+                    batch.append([query.value(i) for i in range(count)])
+                    if len(batch) == 10000:
+                        writer.writerows(batch)
+                        rows += len(batch)
+                        self.signals.progress.emit(rows)
+                        batch = []
+                writer.writerows(batch)
+                rows += len(batch)
+            query.finish()
+        finally:
+            db.close()
+        return rows
+
+class QuerySignals(QObject):
+    finished = pyqtSignal(list, list)
+    error = pyqtSignal(str)
+
+class QueryRunner(QRunnable):
+    def __init__(self, connection_name, sql):
+        super().__init__()
+        self.connection_name = connection_name
+        self.sql = sql
+        self.signals = QuerySignals()
+
+    def run(self):
+        worker_name = f"query_{id(self)}"
+        try:
+            rows, columns = self._query(worker_name)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+            return
+        finally:
+            QSqlDatabase.removeDatabase(worker_name)
+        self.signals.finished.emit(rows, columns)
+
+    def _query(self, worker_name):
+        db = open_worker_connection(self.connection_name, worker_name)
+        try:
+            query = QSqlQuery(db)
+            query.setForwardOnly(True)
+            if not query.exec(self.sql):
+                raise RuntimeError(query.lastError().text())
+            record = query.record()
+            count = record.count()
+            columns = [record.fieldName(i) for i in range(count)]
+            rows = []
+            while query.next():
+                rows.append([query.value(i) for i in range(count)])
+            query.finish()
+        finally:
+            db.close()
+        return rows, columns
+
+class ResultModel(QAbstractTableModel):
+    # Read-only view over the tuples returned by a QueryRunner
+    def __init__(self, rows, columns, parent=None):
+        super().__init__(parent)
+        self.rows = rows
+        self.columns = columns
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            if 0 <= index.row() < len(self.rows) and 0 <= index.column() < len(self.columns):
+                return self.rows[index.row()][index.column()]
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return self.columns[section] if 0 <= section < len(self.columns) else None
+        return section + 1
+
+class LazySqlModel(QAbstractTableModel):
+    # Pages a table in by rowid, one batch per fetchMore, instead of selecting it all.
+    # Edits are reported through cellEdited and written by the viewer.
+    cellEdited = pyqtSignal(int, int, object)
+    fetchFailed = pyqtSignal(str)
+    batch_size = 256
+
+    def __init__(self, prep, table_name, columns, parent=None, key_column=None, has_rowid=True):
+        super().__init__(parent)
+        self.prep = prep
+        self.table_name = table_name
+        # Names as declared; the driver's field names lose embedded quotes
+        self.columns = columns
+        # Index of the INTEGER PRIMARY KEY column, whose edits change the row's rowid
+        self.key_column = key_column
+        # WITHOUT ROWID tables are paged by position and shown read-only
+        self.has_rowid = has_rowid
+        self.rowids = []
+        self.rows = []
+        self.at_end = False
+
+    def select(self):
+        self.beginResetModel()
+        self.rowids = []
+        self.rows = []
+        self.at_end = False
+        try:
+            self._append(self._fetch())
+        finally:
+            # Leave the view consistent (and empty) if the table can't be read
+            self.endResetModel()
+
+    def _fetch(self):
+        # Seek past the last loaded rowid so each batch costs the same however far down it is
+        if not self.has_rowid:
+            query = self.prep(f'SELECT NULL, * FROM {_ident(self.table_name)} '
+                              f'LIMIT {self.batch_size} OFFSET ?')
+            query.bindValue(0, len(self.rows))
+        elif self.rowids:
+            query = self.prep(f'SELECT rowid, * FROM {_ident(self.table_name)} WHERE rowid > ? '
+                              f'ORDER BY rowid LIMIT {self.batch_size}')
+            query.bindValue(0, self.rowids[-1])
+        else:
+            query = self.prep(f'SELECT rowid, * FROM {_ident(self.table_name)} '
+                              f'ORDER BY rowid LIMIT {self.batch_size}')
+        if not query.exec():
+            raise RuntimeError(query.lastError().text())
+        count = query.record().count()
+        batch = []
+        while query.next():
+            batch.append([query.value(i) for i in range(count)])
+        query.finish()
+        if len(batch) < self.batch_size:
+            self.at_end = True
+        return batch
+
+    def _append(self, batch):
+        for row in batch:
+            self.rowids.append(row[0])
+            self.rows.append(row[1:])
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.at_end
+
+    def fetchMore(self, parent=QModelIndex()):
+        # Called by the view; an exception escaping here would abort the application
+        try:
+            batch = self._fetch()
+        except RuntimeError as e:
+            self.at_end = True
+            self.fetchFailed.emit(str(e))
+            return
+        if batch:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(batch) - 1)
+            self._append(batch)
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            # Rows fetched after a schema change can be shorter than the column list
+            row = self.rows[index.row()] if 0 <= index.row() < len(self.rows) else ()
+            return row[index.column()] if 0 <= index.column() < len(row) else None
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return self.columns[section] if 0 <= section < len(self.columns) else None
+        return section + 1
+
+    def flags(self, index):
+        if not self.has_rowid:
+            return super().flags(index)
+        return super().flags(index) | Qt.ItemFlag.ItemIsEditable
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.EditRole or not index.isValid():
+            return False
+        if value != self.rows[index.row()][index.column()]:
+            self.cellEdited.emit(index.row(), index.column(), value)
+        return True
+
+    def set_value(self, rowid, col, value):
+        # Rows are loaded in rowid order, so the row can be found by bisection
+        row = bisect_left(self.rowids, rowid)
+        if row < len(self.rowids) and self.rowids[row] == rowid:
+            self.rows[row][col] = value
+            index = self.index(row, col)
+            self.dataChanged.emit(index, index)
+
 class DatabaseViewer(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -55,32 +320,22 @@ class DatabaseViewer(QMainWindow):
         self.addToolBar(self.toolbar)
         
         # Toolbar actions
-        self.open_db_action = QAction("Open DB", self)
-        self.open_db_action.triggered.connect(self.open_database)
-        self.new_table_action = QAction("New Table", self)
-        self.new_table_action.triggered.connect(self.create_table)
-        self.delete_table_action = QAction("Delete Table", self)
-        self.delete_table_action.triggered.connect(self.delete_table)
-        self.export_csv_action = QAction("Export to CSV", self)
-        self.export_csv_action.triggered.connect(self.export_to_csv)
-        self.add_row_action = QAction("Add Row", self)
-        self.add_row_action.triggered.connect(self.add_row)
-        self.add_column_action = QAction("Add Column", self)
-        self.add_column_action.triggered.connect(self.add_column)
-        self.delete_column_action = QAction("Delete Column", self)
-        self.delete_column_action.triggered.connect(self.delete_column)
+        for label, slot in (
+            ("Open DB", self.open_database),
+            ("New Table", self.create_table),
+            ("Delete Table", self.delete_table),
+            ("Add Row", self.add_row),
+            ("Add Column", self.add_column),
+            ("Delete Column", self.delete_column),
+            ("Export to CSV", self.export_to_csv),
+        ):
+            action = QAction(label, self)
+            action.triggered.connect(slot)
+            self.toolbar.addAction(action)
         self.undo_action = QAction("Undo", self)
-        self.undo_action.triggered.connect(self.undo_stack.undo)
+        self.undo_action.triggered.connect(self.undo)
         self.undo_action.setEnabled(False)
         self.undo_stack.canUndoChanged.connect(self.undo_action.setEnabled)
-        
-        self.toolbar.addAction(self.open_db_action)
-        self.toolbar.addAction(self.new_table_action)
-        self.toolbar.addAction(self.delete_table_action)
-        self.toolbar.addAction(self.add_row_action)
-        self.toolbar.addAction(self.add_column_action)
-        self.toolbar.addAction(self.delete_column_action)
-        self.toolbar.addAction(self.export_csv_action)
         self.toolbar.addAction(self.undo_action)
         
         # Main widget and layout
@@ -113,6 +368,10 @@ class DatabaseViewer(QMainWindow):
         self.table_view = QTableView()
         self.table_view.setSelectionMode(QTableView.SelectionMode.SingleSelection)
         self.table_view.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        # Fixed row heights and pixel scrolling avoid per-row layout work on long tables
+        self.table_view.setHorizontalScrollMode(QTableView.ScrollMode.ScrollPerPixel)
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table_view.verticalScrollBar().valueChanged.connect(self.on_table_scrolled)
         self.table_layout.addWidget(self.table_combo)
         self.table_layout.addWidget(self.table_view)
         
@@ -123,6 +382,276 @@ class DatabaseViewer(QMainWindow):
         self.db = None
         self.model = None
         self.connection_name = f"db_{id(self)}"
+        self._stmt_cache: dict[str, QSqlQuery] = {}
+        self._tables: list[str] = []
+        self._headers: list[str] = []
+        self._view_sql = ""
+        self._columns_cache: dict[tuple[str, int], list[tuple[str, str]]] = {}
+        self._sqlite_version = (0, 0, 0)
+        # Table and column names the temp undo trigger was built for
+        self._undo_table = None
+        self._undo_columns: list[str] = []
+        self._undo_log = _UndoLog()
+        
+        # Cell edits are queued and written together shortly after the last one
+        self._pending_writes: list[tuple[str, tuple]] = []
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(250)
+        self._flush_timer.timeout.connect(self._flush_edits)
+
+    def _prep(self, sql):
+        # Prepared statements are cached by SQL text so repeated edits skip sqlite3_prepare.
+        # Qt links its own copy of SQLite, so the driver handle can't be passed to
+        # sqlite3_prepare_v3 through ctypes; cached statements are reset with finish()
+        # after each use instead. One-shot statements use a plain QSqlQuery, made
+        # forward-only when they return rows.
+        query = self._stmt_cache.get(sql)
+        if query is None:
+            query = QSqlQuery(self.db)
+            query.prepare(sql)
+            self._stmt_cache[sql] = query
+        return query
+
+    def _clear_stmt_cache(self):
+        # Release cached statements before schema changes or closing the connection
+        for query in self._stmt_cache.values():
+            query.finish()
+        self._stmt_cache.clear()
+
+    def _queue_write(self, sql, params):
+        self._pending_writes.append((sql, params))
+        self._flush_timer.start()
+
+    def _flush_edits(self):
+        # Write all queued cell edits in a single transaction
+        self._flush_timer.stop()
+        if not self._pending_writes:
+            return True
+        
+        writes, self._pending_writes = self._pending_writes, []
+        self.db.transaction()
+        for sql, params in writes:
+            query = self._prep(sql)
+            for i, value in enumerate(params):
+                query.bindValue(i, value)
+            if not query.exec():
+                error = query.lastError().text()
+            elif query.numRowsAffected() == 0:
+                error = "The row no longer exists"
+            else:
+                query.finish()
+                continue
+            query.finish()
+            self.db.rollback()
+            QMessageBox.critical(self, "Error", f"Error saving changes: {error}")
+            self.status_bar.showMessage("Saving changes failed")
+            # Show what is actually stored again
+            self._reselect()
+            return False
+        self.db.commit()
+        self._drain_undo_log()
+        return True
+
+    def _reselect(self):
+        # Reload the displayed table; this runs from Qt slots, so errors go to the status bar
+        if isinstance(self.model, LazySqlModel):
+            try:
+                self.model.select()
+            except RuntimeError as e:
+                self.status_bar.showMessage(f"Error reloading table: {str(e)}")
+
+    def _write_key_change(self):
+        # Rows are addressed by rowid, which changes with the key; reload them in the new order
+        if self._flush_edits():
+            self._reselect()
+
+    def _track_table(self, table_name):
+        # Log the pre- and post-image of every UPDATE on the table into temp._undo_log.
+        # The trigger names its columns, so it is dropped before any schema change. It stops
+        # logging once _UNDO_LIMIT entries are waiting; the log's rowids restart after each drain.
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        query.exec("DROP TRIGGER IF EXISTS temp._undo_capture")
+        self._undo_table = None
+        self._undo_columns = []
+        if not table_name:
+            return
+        columns = [name for name, _ in self._table_columns(table_name)]
+        # A changed key moves the row to a new rowid. Its entry is logged first with both
+        # rowids; the other columns' entries address the row by its new one.
+        key = self._key_column(table_name)
+        body = "".join(
+            f"INSERT INTO _undo_log SELECT {'OLD' if column == key else 'NEW'}.rowid, NEW.rowid, {i}, "
+            f"OLD.{_ident(column)}, NEW.{_ident(column)} WHERE OLD.{_ident(column)} IS NOT NEW.{_ident(column)}; "
+            for i, column in sorted(enumerate(columns), key=lambda item: item[1] != key))
+        if columns and query.exec(f"CREATE TEMP TRIGGER _undo_capture AFTER UPDATE ON main.{_ident(table_name)} "
+                                  f"WHEN coalesce((SELECT max(rowid) FROM _undo_log), 0) < {_UNDO_LIMIT} "
+                                  f"BEGIN {body}END"):
+            self._undo_table = table_name
+            self._undo_columns = columns
+
+    def _drain_undo_log(self, text=None):
+        # Turn logged cell changes into undo commands; several from one statement undo as one step.
+        # Returns False if the changes were too many to keep.
+        if self._undo_table is None:
+            return True
+        query = self._prep("SELECT rid, new_rid, col, old, new FROM _undo_log ORDER BY rowid")
+        query.exec()
+        changes = []
+        while query.next():
+            changes.append(tuple(query.value(i) for i in range(5)))
+        query.finish()
+        if not changes:
+            return True
+        self._clear_undo_log()
+        if len(changes) >= _UNDO_LIMIT:
+            # Older commands may not match the table after an untracked change, so drop them too
+            self.undo_stack.clear()
+            self._undo_log.clear()
+            self._reselect_table(self._undo_table)
+            return False
+        
+        macro = text is not None and len(changes) > 1
+        if macro:
+            self.undo_stack.beginMacro(text)
+        moved = False
+        for rowid, new_rowid, col, old_value, new_value in changes:
+            column = self._undo_columns[col]
+            moved = moved or rowid != new_rowid
+            if not moved:
+                self._show_value(self._undo_table, column, rowid, new_value)
+            index = self._undo_log.append(self._undo_table, column, rowid, new_rowid, old_value, new_value)
+            self.undo_stack.push(UpdateCommand(self, index))
+        if macro:
+            self.undo_stack.endMacro()
+        if moved:
+            self._reselect_table(self._undo_table)
+        return True
+
+    def _replay_update(self, table_name, column_name, rowid, value, new_rowid):
+        # Undo/redo writes straight through; the log rows it triggers are not new user changes.
+        # The row is found by rowid before the write and is at new_rowid after it.
+        query = self._prep(f"UPDATE {_ident(table_name)} SET {_ident(column_name)}=? WHERE rowid=?")
+        query.bindValue(0, value)
+        query.bindValue(1, rowid)
+        if not query.exec():
+            error = query.lastError().text()
+        elif query.numRowsAffected() == 0:
+            error = "The row no longer exists"
+        else:
+            error = None
+        query.finish()
+        if error is not None:
+            QMessageBox.critical(self, "Error", f"Error saving changes: {error}")
+            self.status_bar.showMessage("Saving changes failed")
+            return
+        if self._undo_table is not None:
+            self._clear_undo_log()
+        if new_rowid != rowid:
+            self._reselect_table(table_name)
+        else:
+            self._show_value(table_name, column_name, rowid, value)
+
+    def _reselect_table(self, table_name):
+        if isinstance(self.model, LazySqlModel) and self.model.table_name == table_name:
+            self._reselect()
+
+    def _clear_undo_log(self):
+        query = self._prep("DELETE FROM _undo_log")
+        query.exec()
+        query.finish()
+
+    def _show_value(self, table_name, column_name, rowid, value):
+        model = self.model
+        if (isinstance(model, LazySqlModel) and model.table_name == table_name
+                and column_name in model.columns):
+            model.set_value(rowid, model.columns.index(column_name), value)
+
+    def undo(self):
+        # Edits still waiting for the flush timer become undo commands first
+        self._flush_edits()
+        self.undo_stack.undo()
+
+    def _release_model(self):
+        # Write pending edits before the model is replaced or the schema changes
+        self._flush_edits()
+        self._track_table(None)
+        self._headers = []
+
+    def _table_columns(self, table_name):
+        # Read (name, type) pairs of the columns SELECT * returns, cached until the schema changes
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        query.exec("PRAGMA schema_version")
+        query.next()
+        key = (table_name, query.value(0))
+        columns = self._columns_cache.get(key)
+        if columns is None:
+            query.exec(f"PRAGMA main.table_xinfo({_ident(table_name)})")
+            columns = []
+            while query.next():
+                if query.value(6) != 1:
+                    columns.append((query.value(1), query.value(2)))
+            self._columns_cache[key] = columns
+        query.finish()
+        return columns
+
+    def _has_rowid(self, table_name):
+        # WITHOUT ROWID tables have no rowid to page by or address edits with
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        has_rowid = query.exec(f"SELECT rowid FROM {_ident(table_name)} LIMIT 0")
+        query.finish()
+        return has_rowid
+
+    def _key_column(self, table_name):
+        # Name of the INTEGER PRIMARY KEY column that aliases the rowid, if there is one
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        query.exec(f"PRAGMA main.table_info({_ident(table_name)})")
+        keys = []
+        while query.next():
+            if query.value(5):
+                keys.append((query.value(1), query.value(2)))
+        query.finish()
+        if len(keys) == 1 and keys[0][1].upper() == "INTEGER":
+            return keys[0][0]
+        return None
+
+    def _drop_column(self, table_name, column_name):
+        self._release_model()
+        self._clear_stmt_cache()
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        if self._sqlite_version >= (3, 35, 0):
+            # Key, unique and indexed columns are refused; report that rather than rebuilding
+            # the table, which would lose its constraints and indexes
+            if not query.exec(f"ALTER TABLE {_ident(table_name)} DROP COLUMN {_ident(column_name)}"):
+                raise RuntimeError(query.lastError().text())
+            self.db.commit()
+            return
+        
+        # Older SQLite doesn't support direct column deletion, so we need to recreate the table
+        columns = [_ident(name) for name, _ in self._table_columns(table_name) if name != column_name]
+        
+        # Copy the remaining columns in a single pass, then swap the tables
+        temp_table = _ident(f"{table_name}_temp")
+        columns_list = ", ".join(columns)
+        # Take the write lock up front and swap atomically, so a failure never leaves the _temp copy behind
+        if not query.exec("BEGIN IMMEDIATE"):
+            raise RuntimeError(query.lastError().text())
+        for sql in (f"CREATE TABLE {temp_table} AS SELECT {columns_list} FROM {_ident(table_name)}",
+                    f"DROP TABLE {_ident(table_name)}",
+                    f"ALTER TABLE {temp_table} RENAME TO {_ident(table_name)}"):
+            if not query.exec(sql):
+                error = query.lastError().text()
+                self.db.rollback()
+                raise RuntimeError(error)
+        if not self.db.commit():
+            error = self.db.lastError().text()
+            self.db.rollback()
+            raise RuntimeError(error)
 
     def open_database(self):
         file_name, _ = QFileDialog.getOpenFileName(
@@ -135,6 +664,13 @@ class DatabaseViewer(QMainWindow):
         if file_name:
             try:
                 # Close existing database if open
+                if self.db and self.db.isOpen():
+                    self._release_model()
+                # The old model's statements would run against the new connection
+                self.model = None
+                self.table_view.setModel(None)
+                self._clear_stmt_cache()
+                self._columns_cache.clear()
                 if self.db and self.db.isOpen():
                     self.db.close()
                     QSqlDatabase.removeDatabase(self.connection_name)
@@ -148,15 +684,34 @@ class DatabaseViewer(QMainWindow):
                     self.status_bar.showMessage("Database connection failed")
                     return
                 
+                # Tune the connection for interactive use; WAL keeps -wal/-shm files next to the database
+                for pragma in ("journal_mode=WAL", "synchronous=NORMAL", "temp_store=MEMORY",
+                               "cache_size=-65536", "mmap_size=268435456"):
+                    QSqlQuery(f"PRAGMA {pragma}", self.db)
+                # Connection-private log the undo trigger writes cell changes to
+                QSqlQuery("CREATE TEMP TABLE _undo_log (rid INTEGER, new_rid INTEGER, col INTEGER, old, new)", self.db)
+                self._undo_table = None
+                
+                query = QSqlQuery(self.db)
+                query.setForwardOnly(True)
+                query.exec("SELECT sqlite_version()")
+                if query.next():
+                    self._sqlite_version = tuple(int(part) for part in query.value(0).split("."))
+                query.finish()
+                
                 # Update UI
+                # Populate quietly so the first table is only displayed once
+                self._tables = self._user_tables()
+                self.table_combo.blockSignals(True)
                 self.table_combo.clear()
-                tables = self.db.tables()
-                self.table_combo.addItems(tables)
+                self.table_combo.addItems(self._tables)
+                self.table_combo.blockSignals(False)
                 self.status_bar.showMessage(f"Connected to: {file_name}")
                 self.undo_stack.clear()
+                self._undo_log.clear()
                 
-                if tables:
-                    self.display_table(tables[0])
+                if self._tables:
+                    self.display_table(self._tables[0])
                 
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Error opening database: {str(e)}")
@@ -168,47 +723,101 @@ class DatabaseViewer(QMainWindow):
             
         try:
             # Create and set up the model
-            self.model = QSqlTableModel(self, self.db)
-            self.model.setTable(table_name)
-            self.model.setEditStrategy(QSqlTableModel.EditStrategy.OnFieldChange)
-            self.model.dataChanged.connect(self.on_data_changed)
-            self.model.select()
+            self._release_model()
+            columns = [name for name, _ in self._table_columns(table_name)]
+            has_rowid = self._has_rowid(table_name)
+            key = self._key_column(table_name) if has_rowid else None
+            model = LazySqlModel(self._prep, table_name, columns, self,
+                                 key_column=columns.index(key) if key in columns else None,
+                                 has_rowid=has_rowid)
+            model.cellEdited.connect(self.on_data_changed)
+            model.fetchFailed.connect(self.on_fetch_failed)
+            model.select()
+            self.model = model
+            if has_rowid:
+                self._track_table(table_name)
+            self._view_sql = f'SELECT * FROM {_ident(table_name)}'
+            self._cache_headers()
             
             # Set up the view
             self.table_view.setModel(self.model)
-            self.table_view.resizeColumnsToContents()
-            self.status_bar.showMessage(f"Displaying table: {table_name}")
+            self._fit_columns()
+            self.status_bar.showMessage(f"Displaying table: {table_name}"
+                                        + ("" if has_rowid else " (read-only)"))
             
         except Exception as e:
+            # Don't leave the view on the previous table's released model
+            self.model = None
+            self._view_sql = ""
+            self.table_view.setModel(None)
             QMessageBox.critical(self, "Error", f"Error displaying table: {str(e)}")
             self.status_bar.showMessage("Error displaying table")
 
-    def on_data_changed(self, top_left, bottom_right):
-        # Record changes for undo
-        row = top_left.row()
-        col = top_left.column()
-        new_value = self.model.data(top_left)
-        old_value = self.model.data(top_left, Qt.ItemDataRole.UserRole)
-        
-        class UpdateCommand(QUndoCommand):
-            def __init__(self, model, row, col, old_value, new_value, parent=None):
-                super().__init__(parent)
-                self.model = model
-                self.row = row
-                self.col = col
-                self.old_value = old_value
-                self.new_value = new_value
-                self.setText(f"Update cell at row {row}, column {col}")
-            
-            def redo(self):
-                self.model.setData(self.model.index(self.row, self.col), self.new_value)
-            
-            def undo(self):
-                self.model.setData(self.model.index(self.row, self.col), self.old_value)
-        
-        if old_value != new_value:
-            self.undo_stack.push(UpdateCommand(self.model, row, col, old_value, new_value))
-            self.status_bar.showMessage(f"Cell updated at row {row}, column {col}")
+    def on_fetch_failed(self, error):
+        self.status_bar.showMessage(f"Error loading rows: {error}")
+
+    def _reload_table(self):
+        # Rebuild the displayed table's model after a schema change; its columns may differ now
+        if not isinstance(self.model, LazySqlModel):
+            return
+        if self.model.table_name in self._tables:
+            self.display_table(self.model.table_name)
+        else:
+            self._release_model()
+            self.model = None
+            self.table_view.setModel(None)
+
+    def _add_table(self, table_name):
+        self._tables.append(table_name)
+        self.table_combo.addItem(table_name)
+
+    def _remove_table(self, table_name):
+        # Removing the current item selects and displays a neighbouring table
+        self._tables.remove(table_name)
+        self.table_combo.removeItem(self.table_combo.findText(table_name))
+
+    def _user_tables(self):
+        # QSqlDatabase.tables() also lists temp tables, which includes the undo log
+        return [name for name in self.db.tables() if name != "_undo_log"]
+
+    def _refresh_tables(self):
+        # Arbitrary SQL may have changed the schema; apply only the difference to the combo box
+        tables = self._user_tables()
+        for table_name in [name for name in self._tables if name not in tables]:
+            self._remove_table(table_name)
+        for table_name in tables:
+            if table_name not in self._tables:
+                self._add_table(table_name)
+
+    def _cache_headers(self):
+        # Read the header labels once per model instead of on every dialog or export
+        self._headers = [self.model.headerData(i, Qt.Orientation.Horizontal)
+                         for i in range(self.model.columnCount())]
+
+    def _fit_columns(self):
+        # Size columns from the first rows only; the rest is fetched as the user scrolls
+        while self.model.canFetchMore(QModelIndex()) and self.model.rowCount() < 256:
+            self.model.fetchMore(QModelIndex())
+        self.table_view.resizeColumnsToContents()
+
+    def on_table_scrolled(self, value):
+        # Fetch the next batch a page before reaching the bottom
+        scroll_bar = self.table_view.verticalScrollBar()
+        if (self.model is not None and value >= scroll_bar.maximum() - scroll_bar.pageStep()
+                and self.model.canFetchMore(QModelIndex())):
+            self.model.fetchMore(QModelIndex())
+
+    def on_data_changed(self, row, col, value):
+        # The undo trigger records the old value when the queued UPDATE is written
+        rowid = self.model.rowids[row]
+        self.model.set_value(rowid, col, value)
+        self._queue_write(
+            f"UPDATE {_ident(self.model.table_name)} SET {_ident(self.model.columns[col])}=? WHERE rowid=?",
+            (value, rowid))
+        if col == self.model.key_column:
+            # Write it once the view has finished committing the edit
+            QTimer.singleShot(0, self._write_key_change)
+        self.status_bar.showMessage(f"Cell updated at row {row}, column {col}")
 
     def execute_query(self):
         if not self.db or not self.db.isOpen():
@@ -220,31 +829,92 @@ class DatabaseViewer(QMainWindow):
             return
             
         try:
-            query = QSqlQuery(self.db)
-            if query.exec(query_text):
-                # Add to history
-                self.query_history.addItem(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {query_text[:50]}...")
-                
-                # If it's a SELECT query, display results
-                if query_text.strip().upper().startswith('SELECT'):
-                    self.model = QSqlTableModel(self, self.db)
-                    self.model.setQuery(query)
-                    self.table_view.setModel(self.model)
-                    self.table_view.resizeColumnsToContents()
-                    self.status_bar.showMessage("Query executed successfully")
-                else:
-                    self.db.commit()
-                    # Refresh table list if structure changed
-                    self.table_combo.clear()
-                    self.table_combo.addItems(self.db.tables())
-                    self.status_bar.showMessage("Query executed successfully")
-            else:
-                QMessageBox.critical(self, "Error", f"Query error: {query.lastError().text()}")
-                self.status_bar.showMessage("Query execution failed")
+            self._flush_edits()
+            # If it returns rows, run it off the GUI thread and display results
+            if _READ_RE.match(query_text):
+                runner = QueryRunner(self.connection_name, query_text)
+                runner.signals.finished.connect(
+                    lambda rows, columns: self.on_query_finished(query_text, rows, columns))
+                runner.signals.error.connect(lambda error: self.on_read_failed(query_text, error))
+                # Keep the signals object alive until the runner reports back
+                self._query_signals = runner.signals
+                QThreadPool.globalInstance().start(runner)
+                self.status_bar.showMessage("Executing query...")
+                return
+            self._execute_on_main(query_text)
                 
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Query error: {str(e)}")
-            self.status_bar.showMessage("Query execution failed")
+            self.on_query_failed(str(e))
+
+    def on_read_failed(self, query_text, error):
+        # A WITH clause can lead into UPDATE/INSERT/DELETE, which the read-only worker refuses
+        if "readonly database" not in error:
+            self.on_query_failed(error)
+            return
+        try:
+            self._flush_edits()
+            self._execute_on_main(query_text)
+        except Exception as e:
+            self.on_query_failed(str(e))
+
+    def _execute_on_main(self, query_text):
+        # Anything but plain DML may change the schema the undo trigger was built for
+        is_dml = _DML_RE.match(query_text) is not None
+        if not is_dml:
+            self._track_table(None)
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        if query.exec(query_text):
+            # Configuration PRAGMAs and RETURNING clauses also produce rows; keep them
+            rows = None
+            if query.isSelect():
+                record = query.record()
+                count = record.count()
+                columns = [record.fieldName(i) for i in range(count)]
+                rows = []
+                while query.next():
+                    rows.append([query.value(i) for i in range(count)])
+            query.finish()
+            self.db.commit()
+            undoable = self._drain_undo_log(query_text.splitlines()[0][:50])
+            if not is_dml:
+                # The statement may have changed the schema under the cached statements
+                self._clear_stmt_cache()
+                # Refresh table list if structure changed
+                self._refresh_tables()
+                self._reload_table()
+            if rows is not None:
+                self.on_query_finished(query_text, rows, columns, rerunnable=False)
+            else:
+                self._add_to_history(query_text)
+                self.status_bar.showMessage("Query executed successfully" if undoable else
+                                            "Query executed successfully (too many changes to undo)")
+        else:
+            self.on_query_failed(query.lastError().text())
+            if not is_dml and isinstance(self.model, LazySqlModel):
+                self._track_table(self.model.table_name)
+
+    def on_query_finished(self, query_text, rows, columns, rerunnable=True):
+        self._add_to_history(query_text)
+        self._release_model()
+        self.model = ResultModel(rows, columns, self)
+        # Results of statements run on the main connection are exported from memory, since
+        # rerunning them on the read-only clone fails
+        self._view_sql = query_text if rerunnable else None
+        self._cache_headers()
+        self.table_view.setModel(self.model)
+        self._fit_columns()
+        self.status_bar.showMessage(f"Query executed successfully ({len(rows)} rows)")
+
+    def on_query_failed(self, error):
+        QMessageBox.critical(self, "Error", f"Query error: {error}")
+        self.status_bar.showMessage("Query execution failed")
+
+    def _add_to_history(self, query_text):
+        # Keep the full statement on the item; the list shows a preview
+        item = QListWidgetItem(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {query_text[:50]}...")
+        item.setData(Qt.ItemDataRole.UserRole, query_text)
+        self.query_history.addItem(item)
 
     def create_table(self):
         if not self.db or not self.db.isOpen():
@@ -256,11 +926,10 @@ class DatabaseViewer(QMainWindow):
             try:
                 query = QSqlQuery(self.db)
                 # Basic table creation with an ID column
-                create_sql = f"CREATE TABLE {table_name} (id INTEGER PRIMARY KEY AUTOINCREMENT)"
+                create_sql = f"CREATE TABLE {_ident(table_name)} (id INTEGER PRIMARY KEY AUTOINCREMENT)"
                 if query.exec(create_sql):
                     self.db.commit()
-                    self.table_combo.clear()
-                    self.table_combo.addItems(self.db.tables())
+                    self._add_table(table_name)
                     self.status_bar.showMessage(f"Table {table_name} created")
                 else:
                     QMessageBox.critical(self, "Error", f"Error creating table: {query.lastError().text()}")
@@ -281,12 +950,16 @@ class DatabaseViewer(QMainWindow):
                                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
             try:
+                self._release_model()
+                self._clear_stmt_cache()
                 query = QSqlQuery(self.db)
-                if query.exec(f"DROP TABLE {table_name}"):
+                if query.exec(f"DROP TABLE {_ident(table_name)}"):
                     self.db.commit()
-                    self.table_combo.clear()
-                    self.table_combo.addItems(self.db.tables())
-                    self.table_view.setModel(None)
+                    self._remove_table(table_name)
+                    if not self._tables:
+                        self.model = None
+                        self._view_sql = ""
+                        self.table_view.setModel(None)
                     self.status_bar.showMessage(f"Table {table_name} deleted")
                 else:
                     QMessageBox.critical(self, "Error", f"Error deleting table: {query.lastError().text()}")
@@ -294,25 +967,23 @@ class DatabaseViewer(QMainWindow):
                 QMessageBox.critical(self, "Error", f"Error deleting table: {str(e)}")
 
     def add_row(self):
-        if not self.model or not self.db or not self.db.isOpen():
+        # Query results have no table to insert into
+        if not isinstance(self.model, LazySqlModel) or not self.db or not self.db.isOpen():
             QMessageBox.warning(self, "Warning", "No table selected or no database connected")
             return
+        if not self.model.has_rowid:
+            QMessageBox.warning(self, "Warning", f"Table {self.model.table_name} is read-only")
+            return
             
-        dialog = AddRowDialog(self.model, self)
+        dialog = AddRowDialog(self._headers, self)
         if dialog.exec() == QDialog.DialogCode.Accepted:
             values = dialog.get_values()
             try:
-                row = self.model.rowCount()
-                self.model.insertRows(row, 1)
-                for col, header in enumerate(values):
-                    self.model.setData(self.model.index(row, col), values[header])
-                
-                if self.model.submitAll():
-                    self.db.commit()
-                    self.status_bar.showMessage("Row added successfully")
-                    self.undo_stack.push(AddRowCommand(self.model, row))
-                else:
-                    QMessageBox.critical(self, "Error", f"Error adding row: {self.model.lastError().text()}")
+                self._flush_edits()
+                command = AddRowCommand(self, self.model.table_name, values)
+                command.insert()
+                self.undo_stack.push(command)
+                self.status_bar.showMessage("Row added successfully")
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Error adding row: {str(e)}")
 
@@ -324,14 +995,16 @@ class DatabaseViewer(QMainWindow):
         column_name, ok = QInputDialog.getText(self, "Add Column", "Enter column name:")
         if ok and column_name:
             try:
+                self._release_model()
+                self._clear_stmt_cache()
                 query = QSqlQuery(self.db)
                 table_name = self.table_combo.currentText()
-                alter_sql = f"ALTER TABLE {table_name} ADD COLUMN {column_name} TEXT"
+                alter_sql = f"ALTER TABLE {_ident(table_name)} ADD COLUMN {_ident(column_name)} TEXT"
                 if query.exec(alter_sql):
                     self.db.commit()
                     self.display_table(table_name)
                     self.status_bar.showMessage(f"Column {column_name} added")
-                    self.undo_stack.push(AddColumnCommand(self.db, table_name, column_name))
+                    self.undo_stack.push(AddColumnCommand(self, table_name, column_name))
                 else:
                     QMessageBox.critical(self, "Error", f"Error adding column: {query.lastError().text()}")
             except Exception as e:
@@ -343,45 +1016,22 @@ class DatabaseViewer(QMainWindow):
             return
             
         table_name = self.table_combo.currentText()
-        columns = [self.model.headerData(i, Qt.Orientation.Horizontal) 
-                  for i in range(self.model.columnCount())]
         column_name, ok = QInputDialog.getItem(self, "Delete Column", 
-                                             "Select column to delete:", columns, 0, False)
+                                             "Select column to delete:", self._headers, 0, False)
         if ok and column_name:
             reply = QMessageBox.question(self, "Confirm Delete", 
                                        f"Are you sure you want to delete column {column_name}?",
                                        QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
             if reply == QMessageBox.StandardButton.Yes:
                 try:
-                    # SQLite doesn't support direct column deletion, so we need to recreate the table
-                    query = QSqlQuery(self.db)
-                    # Get current table structure
-                    query.exec(f"PRAGMA table_info({table_name})")
-                    columns_info = []
-                    while query.next():
-                        col_name = query.value("name")
-                        if col_name != column_name:
-                            columns_info.append((col_name, query.value("type")))
-                    
-                    # Create new table
-                    temp_table = f"{table_name}_temp"
-                    columns_def = ", ".join(f"{col[0]} {col[1]}" for col in columns_info)
-                    query.exec(f"CREATE TABLE {temp_table} ({columns_def})")
-                    
-                    # Copy data
-                    columns_list = ", ".join(col[0] for col in columns_info)
-                    query.exec(f"INSERT INTO {temp_table} ({columns_list}) SELECT {columns_list} FROM {table_name}")
-                    
-                    # Drop old table and rename new one
-                    query.exec(f"DROP TABLE {table_name}")
-                    query.exec(f"ALTER TABLE {temp_table} RENAME TO {table_name}")
-                    
-                    self.db.commit()
+                    self._drop_column(table_name, column_name)
                     self.display_table(table_name)
                     self.status_bar.showMessage(f"Column {column_name} deleted")
-                    self.undo_stack.push(DeleteColumnCommand(self.db, table_name, column_name))
+                    self.undo_stack.push(DeleteColumnCommand(self, table_name, column_name))
                 except Exception as e:
                     QMessageBox.critical(self, "Error", f"Error deleting column: {str(e)}")
+                    # The model was released for the drop; show the unchanged table again
+                    self.display_table(table_name)
 
     def export_to_csv(self):
         if not self.model:
@@ -396,116 +1046,237 @@ class DatabaseViewer(QMainWindow):
         )
         
         if file_name:
-            try:
-                with open(file_name, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile)
-                    # Write headers
-                    headers = [self.model.headerData(i, Qt.Orientation.Horizontal) 
-                              for i in range(self.model.columnCount())]
-                    writer.writerow(headers)
-                    
-                    # Write data
-                    for row in range(self.model.rowCount()):
-                        row_data = []
-                        for col in range(self.model.columnCount()):
-                            data = self.model.data(self.model.index(row, col))
-                            row_data.append(str(data))
-                        writer.writerow(row_data)
-                    self.status_bar.showMessage(f"Exported to {file_name}")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Error exporting to CSV: {str(e)}")
-                self.status_bar.showMessage("Export failed")
+            if self._view_sql is None:
+                try:
+                    with open(file_name, 'w', newline='', encoding='utf-8') as csvfile:
+                        writer = csv.writer(csvfile)
+                        writer.writerow(self._headers)
+                        writer.writerows(self.model.rows)
+                except OSError as e:
+                    self.on_export_failed(str(e))
+                    return
+                self.status_bar.showMessage(f"Exported {len(self.model.rows)} rows to {file_name}")
+                return
+            # Edits must be committed for the export connection to see them
+            self._flush_edits()
+            task = CsvExportTask(self.connection_name, self._view_sql, file_name)
+            task.signals.progress.connect(
+                lambda rows: self.status_bar.showMessage(f"Exporting... {rows} rows written"))
+            task.signals.finished.connect(
+                lambda rows: self.status_bar.showMessage(f"Exported {rows} rows to {file_name}"))
+            task.signals.error.connect(self.on_export_failed)
+            # Keep the signals object alive until the task reports back
+            self._export_signals = task.signals
+            QThreadPool.globalInstance().start(task)
+            self.status_bar.showMessage(f"Exporting to {file_name}...")
+
+    def on_export_failed(self, error):
+        QMessageBox.critical(self, "Error", f"Error exporting to CSV: {error}")
+        self.status_bar.showMessage("Export failed")
 
     def load_query_from_history(self, item):
-        query_text = item.text().split(": ", 1)[1] + "..."
-        self.query_input.setText(query_text.rstrip("..."))
+        self.query_input.setPlainText(item.data(Qt.ItemDataRole.UserRole))
 
     def closeEvent(self, event):
         # Clean up database connection
+        self._flush_edits()
+        self._clear_stmt_cache()
         if self.db and self.db.isOpen():
             self.db.close()
         QSqlDatabase.removeDatabase(self.connection_name)
         event.accept()
 
 class AddRowCommand(QUndoCommand):
-    def __init__(self, model, row, parent=None):
+    def __init__(self, viewer, table_name, values, parent=None):
         super().__init__(parent)
-        self.model = model
-        self.row = row
+        self.viewer = viewer
+        self.table_name = table_name
+        # Empty fields are left out so column defaults and AUTOINCREMENT keys apply
+        self.values = {column: value for column, value in values.items() if value != ""}
+        self.rowid = None
+        # The row is inserted before the command is pushed
+        self.applied = True
         self.setText("Add row")
         
+    def insert(self):
+        # One parameterized INSERT through the statement cache instead of per-cell model updates
+        if self.values:
+            columns = ", ".join(_ident(column) for column in self.values)
+            placeholders = ", ".join("?" * len(self.values))
+            sql = f'INSERT INTO {_ident(self.table_name)} ({columns}) VALUES ({placeholders})'
+        else:
+            sql = f'INSERT INTO {_ident(self.table_name)} DEFAULT VALUES'
+        query = self.viewer._prep(sql)
+        for i, value in enumerate(self.values.values()):
+            query.bindValue(i, value)
+        if not query.exec():
+            raise RuntimeError(query.lastError().text())
+        self.rowid = query.lastInsertId()
+        query.finish()
+        self.refresh()
+        
+    def refresh(self):
+        model = self.viewer.model
+        if isinstance(model, LazySqlModel) and model.table_name == self.table_name:
+            model.select()
+        
+    def redo(self):
+        if self.applied:
+            self.applied = False
+            return
+        self.insert()
+        
+    def undo(self):
+        query = self.viewer._prep(f'DELETE FROM {_ident(self.table_name)} WHERE rowid=?')
+        query.bindValue(0, self.rowid)
+        query.exec()
+        query.finish()
+        self.refresh()
+
+class _UndoLog:
+    # Cell changes behind the UpdateCommands, stored column-wise and addressed by index.
+    # Table and column names are interned so each entry holds only ints and the two values.
+    def __init__(self):
+        self.names: list[str] = []
+        self._name_ids: dict[str, int] = {}
+        self.tables = array('i')
+        self.columns = array('i')
+        # Rowid of the row before and after the change; they differ when its key changed
+        self.rowids = array('q')
+        self.new_rowids = array('q')
+        self.old_values = []
+        self.new_values = []
+        # 1 while the change is in the database but its command hasn't seen its first redo
+        self.pending = bytearray()
+        
+    def __len__(self):
+        return len(self.rowids)
+        
+    def _intern(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+        
+    def append(self, table_name, column_name, rowid, new_rowid, old_value, new_value):
+        self.tables.append(self._intern(table_name))
+        self.columns.append(self._intern(column_name))
+        self.rowids.append(rowid)
+        self.new_rowids.append(new_rowid)
+        self.old_values.append(old_value)
+        self.new_values.append(new_value)
+        self.pending.append(1)
+        return len(self.rowids) - 1
+        
+    def pop(self):
+        for values in (self.tables, self.columns, self.rowids, self.new_rowids,
+                       self.old_values, self.new_values, self.pending):
+            values.pop()
+        
+    def clear(self):
+        self.__init__()
+        
+    def key(self, index):
+        return self.tables[index], self.columns[index], self.rowids[index]
+        
+    def cell(self, index):
+        return self.names[self.tables[index]], self.names[self.columns[index]], self.rowids[index]
+
+class UpdateCommand(QUndoCommand):
+    # One thin command per change; the data lives in the viewer's _UndoLog
+    def __init__(self, viewer, index, parent=None):
+        super().__init__(parent)
+        self.viewer = viewer
+        self.index = index
+        _, column_name, rowid = viewer._undo_log.cell(index)
+        self.setText(f"Update {column_name} at rowid {rowid}")
+        
+    def id(self):
+        # Consecutive edits of the same cell share an id so they merge
+        return hash(self.viewer._undo_log.key(self.index)) & 0x7FFFFFFF
+        
+    def mergeWith(self, other):
+        log = self.viewer._undo_log
+        if log.key(other.index) != log.key(self.index):
+            return False
+        log.new_values[self.index] = log.new_values[other.index]
+        log.new_rowids[self.index] = log.new_rowids[other.index]
+        # The merged command is discarded; its entry is always the newest one
+        if other.index == len(log) - 1:
+            log.pop()
+        return True
+        
     def redo(self):
-        self.model.insertRows(self.row, 1)
-        self.model.submitAll()
+        log = self.viewer._undo_log
+        if log.pending[self.index]:
+            log.pending[self.index] = 0
+            return
+        self.viewer._replay_update(*log.cell(self.index), log.new_values[self.index],
+                                   log.new_rowids[self.index])
         
     def undo(self):
-        self.model.removeRows(self.row, 1)
-        self.model.submitAll()
+        log = self.viewer._undo_log
+        table_name, column_name, rowid = log.cell(self.index)
+        self.viewer._replay_update(table_name, column_name, log.new_rowids[self.index],
+                                   log.old_values[self.index], rowid)
 
 class AddColumnCommand(QUndoCommand):
-    def __init__(self, db, table_name, column_name, parent=None):
+    def __init__(self, viewer, table_name, column_name, parent=None):
         super().__init__(parent)
-        self.db = db
+        self.viewer = viewer
         self.table_name = table_name
         self.column_name = column_name
+        # The column already exists when the command is pushed
+        self.applied = True
         self.setText(f"Add column {column_name}")
         
     def redo(self):
-        query = QSqlQuery(self.db)
-        query.exec(f"ALTER TABLE {self.table_name} ADD COLUMN {self.column_name} TEXT")
-        self.db.commit()
+        if self.applied:
+            self.applied = False
+            return
+        self.viewer._release_model()
+        self.viewer._clear_stmt_cache()
+        query = QSqlQuery(self.viewer.db)
+        query.exec(f"ALTER TABLE {_ident(self.table_name)} ADD COLUMN {_ident(self.column_name)} TEXT")
+        self.viewer.db.commit()
+        self.viewer.display_table(self.viewer.table_combo.currentText())
         
     def undo(self):
-        # Note: This is simplified; actual column deletion is more complex
-        query = QSqlQuery(self.db)
-        query.exec(f"PRAGMA table_info({self.table_name})")
-        columns_info = []
-        while query.next():
-            col_name = query.value("name")
-            if col_name != self.column_name:
-                columns_info.append((col_name, query.value("type")))
-        
-        temp_table = f"{self.table_name}_temp"
-        columns_def = ", ".join(f"{col[0]} {col[1]}" for col in columns_info)
-        columns_list = ", ".join(col[0] for col in columns_info)
-        
-        query.exec(f"CREATE TABLE {temp_table} ({columns_def})")
-        query.exec(f"INSERT INTO {temp_table} ({columns_list}) SELECT {columns_list} FROM {self.table_name}")
-        query.exec(f"DROP TABLE {self.table_name}")
-        query.exec(f"ALTER TABLE {temp_table} RENAME TO {self.table_name}")
-        self.db.commit()
+        # Note: This is simplified; the rebuilt table doesn't keep constraints
+        try:
+            self.viewer._drop_column(self.table_name, self.column_name)
+        except Exception as e:
+            QMessageBox.critical(self.viewer, "Error", f"Error deleting column: {str(e)}")
+        self.viewer.display_table(self.viewer.table_combo.currentText())
 
 class DeleteColumnCommand(QUndoCommand):
-    def __init__(self, db, table_name, column_name, parent=None):
+    def __init__(self, viewer, table_name, column_name, parent=None):
         super().__init__(parent)
-        self.db = db
+        self.viewer = viewer
         self.table_name = table_name
         self.column_name = column_name
+        # The column has already been dropped when the command is pushed
+        self.applied = True
         self.setText(f"Delete column {column_name}")
         
     def redo(self):
-        query = QSqlQuery(self.db)
-        query.exec(f"PRAGMA table_info({self.table_name})")
-        columns_info = []
-        while query.next():
-            col_name = query.value("name")
-            if col_name != self.column_name:
-                columns_info.append((col_name, query.value("type")))
-        
-        temp_table = f"{self.table_name}_temp"
-        columns_def = ", ".join(f"{col[0]} {col[1]}" for col in columns_info)
-        columns_list = ", ".join(col[0] for col in columns_info)
-        
-        query.exec(f"CREATE TABLE {temp_table} ({columns_def})")
-        query.exec(f"INSERT INTO {temp_table} ({columns_list}) SELECT {columns_list} FROM {self.table_name}")
-        query.exec(f"DROP TABLE {self.table_name}")
-        query.exec(f"ALTER TABLE {temp_table} RENAME TO {self.table_name}")
-        self.db.commit()
+        if self.applied:
+            self.applied = False
+            return
+        try:
+            self.viewer._drop_column(self.table_name, self.column_name)
+        except Exception as e:
+            QMessageBox.critical(self.viewer, "Error", f"Error deleting column: {str(e)}")
+        self.viewer.display_table(self.viewer.table_combo.currentText())
         
     def undo(self):
-        query = QSqlQuery(self.db)
-        query.exec(f"ALTER TABLE {self.table_name} ADD COLUMN {self.column_name} TEXT")
-        self.db.commit()
+        self.viewer._release_model()
+        self.viewer._clear_stmt_cache()
+        query = QSqlQuery(self.viewer.db)
+        query.exec(f"ALTER TABLE {_ident(self.table_name)} ADD COLUMN {_ident(self.column_name)} TEXT")
+        self.viewer.db.commit()
+        self.viewer.display_table(self.viewer.table_combo.currentText())
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)